@@ -1,18 +1,93 @@
 """Library for querying CERL infrastructure"""
 
 from dataclasses import dataclass
+import asyncio
+import os
 import requests 
-from typing import List, Union
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from itertools import chain, islice
+from types import MappingProxyType
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, Union
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from urllib.parse import quote 
-from .utils import the, by_dot
+from .utils import ttl_cache
 
-def setup_requests() -> requests.Session:
+try:
+    # orjson parses bytes directly and considerably faster, install with `pip install cerl[fast]`
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+try:
+    # aiohttp is only needed for the *_async functions, install with `pip install cerl[async]`
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+def _setting(name: str, default: Any, cast: Callable, minimum: Any = None) -> Any:
+    """Reads a setting from the environment, falling back to the default if it is unset or invalid
+
+    Arguments
+    ---------
+    name : str
+        The name of the environment variable
+    default : Any
+        The value to be used if the variable is unset or invalid
+    cast : Callable
+        The function used to convert the value, e.g. int
+    minimum : Any
+        The smallest valid value, if any
+
+    Returns
+    -------
+    Any
+        The value of the setting
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    try:
+        converted = cast(value)
+    except ValueError:
+        converted = None
+    if converted is None or (minimum is not None and converted < minimum):
+        warnings.warn(f"Ignoring invalid value {value!r} for {name}, using {default!r}")
+        return default
+    return converted
+
+# Retry policy shared by the requests session and the *_async functions
+RETRIES = 3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_FACTOR = 1
+# Number of seconds after which a request of the *_async functions is abandoned
+ASYNC_TIMEOUT = 60
+# Maximum number of connections kept open per host and number of requests
+# sent in parallel by ample_query() etc. (capped at the pool size), configurable
+# through the environment
+CONNECTION_POOL_SIZE = _setting('CERL_POOL_SIZE', 64, int, minimum=1)
+MAX_WORKERS = min(_setting('CERL_MAX_WORKERS', 16, int, minimum=1), CONNECTION_POOL_SIZE)
+# Number of records and seconds for which records are cached, configurable through the environment
+CACHE_SIZE = _setting('CERL_CACHE_SIZE', 1024, int, minimum=0)
+CACHE_TTL = _setting('CERL_CACHE_TTL', 300, float, minimum=0)
+
+def setup_requests(pool_maxsize: Optional[int] = None) -> requests.Session:
     """Sets up a requests session to automatically retry on errors
     
     cf. <https://findwork.dev/blog/advanced-usage-python-requests-timeouts-retries-hooks/>
     
+    The session used by this module is created at import time, so to change
+    its pool size either set CERL_POOL_SIZE beforehand or replace it with
+    `cerl.cerl.http = setup_requests(n)`
+
+    Arguments
+    ---------
+    pool_maxsize : int, optional
+        Maximum number of connections kept open per host (default: CONNECTION_POOL_SIZE)
+
     Returns
     -------
     http : requests.Session
@@ -21,13 +96,18 @@ def setup_requests() -> requests.Session:
     http = requests.Session()
     assert_status_hook = lambda response, *args, **kwargs: response.raise_for_status()
     http.hooks["response"] = [assert_status_hook]
+    http.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
     retry_strategy = Retry(
-        total=3,
-        status_forcelist=[429, 500, 502, 503, 504],
+        total=RETRIES,
+        status_forcelist=RETRY_STATUSES,
         allowed_methods=["GET"],
-        backoff_factor=1
+        backoff_factor=BACKOFF_FACTOR
+    )
+    adapter = HTTPAdapter(
+        max_retries=retry_strategy,
+        pool_maxsize=pool_maxsize or CONNECTION_POOL_SIZE,
+        pool_block=False
     )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
     http.mount("https://", adapter)
     http.mount("http://", adapter)
     return http
@@ -53,9 +133,10 @@ class QueryResult:
 
 # === Interacting with the AMPLE API ===
 
-def ample_query_hits(host: str, query: str) -> int:
-    """Requests the number of hits for a query from the AMPLE API
-    
+@lru_cache(maxsize=512)
+def _search_url(host: str, query: str) -> str:
+    """Builds the URL for a search request without the paging parameters
+
     Arguments
     ---------
     host : str
@@ -63,20 +144,104 @@ def ample_query_hits(host: str, query: str) -> int:
     query : str
         The query to be sent
 
+    Returns
+    -------
+    str
+        The URL including the encoded query
+    """
+    return f"https://{host}/_search?query={quote(query)}&format=json"
+
+def _hits(page: dict) -> int:
+    """Reads the number of hits from a page of search results
+
+    Arguments
+    ---------
+    page : dict
+        A page of search results as returned by the AMPLE API
+
     Returns
     -------
     hits : int
         The number of hits returned for the query
     """
-    r = http.get(f"https://{host}/_search?query={quote(query)}&size=1&format=json")
-    j = r.json()
-    hits = j['hits']
+    hits = page['hits']
     if isinstance(hits, dict):
         # AMPLE either returns {'hits': int} or {'hits': {'value': int}}
         hits = hits.get('value', 0)
     return hits
 
-def ample_query_generator(host: str, query: str) -> Union[int, List[dict]]:
+def ample_query_hits(host: str, query: str) -> int:
+    """Requests the number of hits for a query from the AMPLE API
+    
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    query : str
+        The query to be sent
+
+    Returns
+    -------
+    hits : int
+        The number of hits returned for the query
+    """
+    r = http.get(f"{_search_url(host, query)}&size=1")
+    return _hits(json_loads(r.content))
+
+def _ample_page(url: str) -> dict:
+    """Requests a single page of search results
+
+    Arguments
+    ---------
+    url : str
+        The URL of the page, including the paging parameters
+
+    Returns
+    -------
+    dict
+        The page as returned by the AMPLE API
+    """
+    # Read the body straight from the (transparently decompressed) stream and
+    # release the connection back to the pool afterwards
+    with http.get(url, stream=True) as r:
+        r.raw.decode_content = True
+        return json_loads(r.raw.read())
+
+def _ample_pages(host: str, query: str, hits: int) -> Iterator[List[dict]]:
+    """Requests the search results for a query from the AMPLE API page by page
+
+    Pages are requested as they are consumed, with up to MAX_WORKERS pages
+    in flight at a time, and yielded in order.
+
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    query : str
+        The query to be sent
+    hits : int
+        The number of hits, as returned by ample_query_hits()
+
+    Yields
+    ------
+    rows : list[dict]
+        A list of dictionaries representing (abbreviated) records
+    """
+    base = _search_url(host, query)
+    # ElasticSearch will not return more than 10.000 records, so not point querying beyond that
+    offsets = iter(range(0, min(hits, 10000), 100))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        pending = deque(
+            executor.submit(_ample_page, f"{base}&size=100&from={offset}")
+            for offset in islice(offsets, MAX_WORKERS)
+        )
+        while pending:
+            page = pending.popleft().result()
+            for offset in islice(offsets, 1):
+                pending.append(executor.submit(_ample_page, f"{base}&size=100&from={offset}"))
+            yield page.get('rows', [])
+
+def ample_query_generator(host: str, query: str) -> Iterator[Union[int, List[dict]]]:
     """Requests the search results for a query from the AMPLE API in chunks of 100 records
     
     Arguments
@@ -92,17 +257,139 @@ def ample_query_generator(host: str, query: str) -> Union[int, List[dict]]:
         Number of hits (first value yielded)
     rows : list[dict]
         A list of dictionaries representing (abbreviated) records (all subsequent values yielded)
+
+    .. deprecated::
+        Use ample_query(), which requests the pages in parallel
     """
-    hits = ample_query_hits(host, query)
-    yield hits
+    warnings.warn(
+        "ample_query_generator() is deprecated, use ample_query() instead",
+        DeprecationWarning,
+        stacklevel=2
+    )
 
-    offset = 0 
-    # ElasticSearch will not return more than 10.000 records, so not point querying beyond that
-    while offset < hits and offset < 10000:
-        r = http.get(f"https://{host}/_search?query={quote(query)}&size=100&from={offset}&format=json")
-        rows = r.json().get('rows', [])
-        offset += 100
-        yield rows
+    def generator():
+        hits = ample_query_hits(host, query)
+        yield hits
+        yield from _ample_pages(host, query, hits)
+
+    return generator()
+
+def _async_session() -> "aiohttp.ClientSession":
+    """Sets up an aiohttp session for the *_async functions
+
+    Returns
+    -------
+    aiohttp.ClientSession
+        The session, to be used as an asynchronous context manager
+
+    Raises
+    ------
+    ImportError
+        If aiohttp is not installed
+    """
+    if aiohttp is None:
+        raise ImportError("The *_async functions require aiohttp, install with `pip install cerl[async]`")
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=CONNECTION_POOL_SIZE),
+        timeout=aiohttp.ClientTimeout(total=ASYNC_TIMEOUT),
+        headers={'Accept-Encoding': 'gzip, deflate'}
+    )
+
+async def _get_async(session: "aiohttp.ClientSession", semaphore: asyncio.Semaphore, url: str) -> bytes:
+    """Sends a GET request, retrying with the same policy as the requests session
+
+    The semaphore keeps requests from queueing for a free connection, as
+    that waiting time would count against ASYNC_TIMEOUT.
+
+    Arguments
+    ---------
+    session : aiohttp.ClientSession
+        The session used to send the request
+    semaphore : asyncio.Semaphore
+        Limits the number of concurrent requests to CONNECTION_POOL_SIZE
+    url : str
+        The URL to be requested
+
+    Returns
+    -------
+    bytes
+        The body of the response
+
+    Raises
+    ------
+    aiohttp.ClientResponseError
+        If the server still responds with an error after all retries
+    """
+    for attempt in range(RETRIES + 1):
+        try:
+            async with semaphore, session.get(url) as r:
+                if r.status not in RETRY_STATUSES or attempt == RETRIES:
+                    r.raise_for_status()
+                    return await r.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == RETRIES:
+                raise
+        await asyncio.sleep(BACKOFF_FACTOR * 2 ** attempt)
+
+async def ample_query_async(host: str, query: str) -> QueryResult:
+    """Requests the search results for a query from the AMPLE API concurrently
+    
+    The number of hits is requested first, then all pages of 100 records
+    are requested at the same time.
+
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    query : str
+        The query to be sent    
+
+    Returns
+    -------
+    QueryResult
+        A QueryResult object containing the number of hits and up to 10.000 search results    
+    """
+    base = _search_url(host, query)
+    async with _async_session() as session:
+        semaphore = asyncio.Semaphore(CONNECTION_POOL_SIZE)
+        hits = _hits(json_loads(await _get_async(session, semaphore, f"{base}&size=1")))
+
+        async def fetch(offset: int) -> List[dict]:
+            page = json_loads(await _get_async(session, semaphore, f"{base}&size=100&from={offset}"))
+            return page.get('rows', [])
+
+        # ElasticSearch will not return more than 10.000 records, so not point querying beyond that
+        pages = await asyncio.gather(*[fetch(offset) for offset in range(0, min(hits, 10000), 100)])
+    rows = list(chain.from_iterable(pages))
+    return QueryResult(hits, rows)
+
+def ample_query_iter(host: str, query: str) -> Tuple[int, Iterator[dict]]:
+    """Requests the search results for a query from the AMPLE API lazily
+
+    Only the number of hits is requested immediately; pages of results are
+    requested while the rows are being consumed, so memory use does not grow
+    with the size of the result and the iteration can be stopped early.
+
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    query : str
+        The query to be sent    
+
+    Returns
+    -------
+    hits : int
+        The number of hits returned for the query
+    rows : Iterator[dict]
+        An iterator over dictionaries representing the (abbreviated) records
+
+    See also
+    --------
+    ample_query : Returns all rows at once
+    """
+    hits = ample_query_hits(host, query)
+    return hits, chain.from_iterable(_ample_pages(host, query, hits))
 
 def ample_query(host: str, query: str) -> QueryResult:
     """Requests the search results for a query from the AMPLE API
@@ -118,14 +405,29 @@ def ample_query(host: str, query: str) -> QueryResult:
     -------
     QueryResult
         A QueryResult object containing the number of hits and up to 10.000 search results    
+
+    See also
+    --------
+    ample_query_iter : Iterates over the search results instead
+    ample_query_async : Coroutine version of this function
     """
-    generator = ample_query_generator(host, query)
-    hits = next(generator)
-    if hits:
-        rows = list(sum(list(generator), []))
-    else:
-        rows = []
-    return QueryResult(hits, rows)
+    hits, rows = ample_query_iter(host, query)
+    return QueryResult(hits, list(rows))
+
+def ids_from_rows(rows: Iterable[dict]) -> Iterator[str]:
+    """Extract the IDs from (abbreviated) records lazily
+
+    Arguments
+    ---------
+    rows : Iterable[dict]
+        The rows of a QueryResult or the iterator returned by ample_query_iter()
+    
+    Returns
+    -------
+    Iterator[str]
+        The IDs of the records
+    """
+    return (row.get('id', None) for row in rows)
 
 def ids_from_result(result: QueryResult) -> List[str]:
     """Extract the IDs from a QueryResult object
@@ -140,10 +442,13 @@ def ids_from_result(result: QueryResult) -> List[str]:
     list[str]
         The IDs of all records contained in the QueryResult
     """
-    return [row.get('id', None) for row in result.rows]
+    return list(ids_from_rows(result.rows))
+
+@ttl_cache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+def _ample_record_request(host: str, idx: str, form: str, style: str) -> Tuple[bytes, Optional[str]]:
+    """Requests a record through the AMPLE API and returns the undecoded response body
 
-def _ample_record_request(host: str, idx: str, form: str, style: str) -> requests.Response:
-    """Requests a record through the AMPLE API and returns the response
+    Responses are cached for CACHE_TTL seconds, see clear_cache()
 
     Arguments
     ---------
@@ -159,12 +464,51 @@ def _ample_record_request(host: str, idx: str, form: str, style: str) -> request
 
     Returns
     -------
-    r : requests.Response
-        A requests Response object containing the record
+    content : bytes
+        The body of the response containing the record
+    encoding : str or None
+        The encoding of the body declared by the server
     """
 
     r = http.get(f"https://{host}/{quote(idx)}?format={form}&style={style}")
-    return r
+    return r.content, r.encoding
+
+async def _ample_record_request_async(session: "aiohttp.ClientSession", semaphore: asyncio.Semaphore, host: str, idx: str, form: str, style: str) -> bytes:
+    """Requests a record through the AMPLE API and returns the response body
+
+    Arguments
+    ---------
+    session : aiohttp.ClientSession
+        The session used to send the request
+    semaphore : asyncio.Semaphore
+        Limits the number of concurrent requests, see _get_async()
+    host : str
+        The URL for the AMPLE service to be queried
+    idx : str
+        The identifier of the record to be requested
+    form : str
+        The form argument to be passed to the API
+    style : str
+        The form argument to be passed to the API
+        (Form and Style together determine the record format)
+
+    Returns
+    -------
+    bytes
+        The body of the response containing the record
+    """
+    return await _get_async(session, semaphore, f"https://{host}/{quote(idx)}?format={form}&style={style}")
+
+# The AMPLE API determines record format from a combination
+# of the two arguments 'form' and 'style', so these are
+# resolved here:
+_EXPORT_FORMATS = MappingProxyType({
+    'rdf/ttl': ('txt', 'ttl'),
+    'yaml': ('txt', None),
+    'rdf/xml': ('rdfxml', None),
+    'rdf/jsonld': ('json', 'jsonld'),
+    'unimarc': ('txt', 'internal')
+})
 
 def ample_record_export(host: str, idx: str, export: str) -> str:
     """Returns a record as a string in an export format
@@ -188,17 +532,9 @@ def ample_record_export(host: str, idx: str, export: str) -> str:
     ample_record : Returns the record as a Python dictionary
     """
 
-    # The AMPLE API determines record format from a combination
-    # of the two arguments 'form' and 'style', so these are
-    # resolved here:
-    form, style = {
-        'rdf/ttl': ('txt', 'ttl'),
-        'yaml': ('txt', None),
-        'rdf/xml': ('rdfxml', None),
-        'rdf/jsonld': ('json', 'jsonld'),
-        'unimarc': ('txt', 'internal')
-    }.get(export, ('json', None))
-    return _ample_record_request(host, idx, form, style).text
+    form, style = _EXPORT_FORMATS.get(export, ('json', None))
+    content, encoding = _ample_record_request(host, idx, form, style)
+    return content.decode(encoding or 'utf-8', errors='replace')
 
 def ample_record(host: str, idx: str) -> dict:
     """Returns a record as a dictionary
@@ -219,7 +555,59 @@ def ample_record(host: str, idx: str) -> dict:
     --------
     ample_record_export : Return the record as a String and in various formats
     """
-    return _ample_record_request(host, idx, 'json', None).json()
+    content, _ = _ample_record_request(host, idx, 'json', None)
+    return json_loads(content)
+
+def clear_cache() -> None:
+    """Empties the cache of records requested through the AMPLE API"""
+    _ample_record_request.cache_clear()
+
+async def ample_records_async(host: str, ids: List[str]) -> List[dict]:
+    """Requests several records concurrently and returns them as dictionaries
+
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    ids : list[str]
+        The identifiers of the records to be requested, e.g. from ids_from_result()
+
+    Returns
+    -------
+    list[dict]
+        The records in the same order as the identifiers
+    """
+    async with _async_session() as session:
+        semaphore = asyncio.Semaphore(CONNECTION_POOL_SIZE)
+        bodies = await asyncio.gather(*[
+            _ample_record_request_async(session, semaphore, host, idx, 'json', None) for idx in ids
+        ])
+    return [json_loads(body) for body in bodies]
+
+def ample_records(host: str, ids: List[str]) -> List[dict]:
+    """Returns several records as dictionaries, requesting them in parallel threads
+
+    Records are read from and added to the same cache as ample_record().
+
+    Arguments
+    ---------
+    host : str
+        The URL for the AMPLE service to be queried
+    ids : list[str]
+        The identifiers of the records to be requested, e.g. from ids_from_result()
+
+    Returns
+    -------
+    list[dict]
+        The records in the same order as the identifiers
+
+    See also
+    --------
+    ample_record : Returns a single record
+    ample_records_async : Coroutine version of this function (not cached)
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        return list(executor.map(partial(ample_record, host), ids))
 
 # === Interacting with records ===
 
@@ -242,10 +630,20 @@ def cid(record: dict) -> str:
     ValueError
         If no identifier is found in the record
     """
-    cid = the(by_dot(record, '_id'))
-    if not isinstance(cid, str):
-        raise ValueError(f"Not a string: {cid}")
-    return cid
+    cid = record.get('_id')
+    if isinstance(cid, str) and cid:
+        return cid
+    if isinstance(cid, list) and len(cid) == 1 and isinstance(cid[0], str) and cid[0]:
+        return cid[0]
+    raise ValueError(f"No identifier found: {cid!r}")
+
+# CERL Thesaurus record types by identifier prefix
+_CT_RECORD_TYPES = MappingProxyType({
+    'cnl': 'place',
+    'cnp': 'person',
+    'cni': 'printer',
+    'cnc': 'corporate'
+})
 
 def ct_record_type(record: dict) -> str:
     """Infers the CERL Thesaurus record type from the identifier
@@ -260,28 +658,23 @@ def ct_record_type(record: dict) -> str:
     str
         The human-readable record type of the record
     """
-    return {
-        'cnl': 'place',
-        'cnp': 'person',
-        'cni': 'printer',
-        'cnc': 'corporate'
-    }.get(cid(record)[:3], 'unspecified')
+    return _CT_RECORD_TYPES.get(cid(record)[:3], 'unspecified')
 
 # === Hardcoded databases ===
 
 CT, ISTC, HOLDINST, MEI = (f'data.cerl.org/{db}' for db in ('thesaurus', 'istc', 'holdinst', 'mei'))
 
-ct_query                = lambda query: ample_query(CT, query)
-holdinst_query          = lambda query: ample_query(HOLDINST, query)
-istc_query              = lambda query: ample_query(ISTC, query)
-mei_query               = lambda query: ample_query(MEI, query)
+ct_query                = partial(ample_query, CT)
+holdinst_query          = partial(ample_query, HOLDINST)
+istc_query              = partial(ample_query, ISTC)
+mei_query               = partial(ample_query, MEI)
 
-ct_record               = lambda *args, **kwargs: ample_record(CT, *args, **kwargs)
-holdinst_record         = lambda *args, **kwargs: ample_record(HOLDINST, *args, **kwargs)
-istc_record             = lambda *args, **kwargs: ample_record(ISTC, *args, **kwargs)
-mei_record              = lambda *args, **kwargs: ample_record(MEI, *args, **kwargs)
+ct_record               = partial(ample_record, CT)
+holdinst_record         = partial(ample_record, HOLDINST)
+istc_record             = partial(ample_record, ISTC)
+mei_record              = partial(ample_record, MEI)
 
-ct_record_export        = lambda *args, **kwargs: ample_record_export(CT, *args, **kwargs)
-holdinst_record_export  = lambda *args, **kwargs: ample_record_export(HOLDINST, *args, **kwargs)
-istc_record_export      = lambda *args, **kwargs: ample_record_export(ISTC, *args, **kwargs)
-mei_record_export       = lambda *args, **kwargs: ample_record_export(MEI, *args, **kwargs)
\ No newline at end of file
+ct_record_export        = partial(ample_record_export, CT)
+holdinst_record_export  = partial(ample_record_export, HOLDINST)
+istc_record_export      = partial(ample_record_export, ISTC)
+mei_record_export       = partial(ample_record_export, MEI)
\ No newline at end of file
@@ -1,4 +1,8 @@
-from typing import Any, Union
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Tuple, Union
 
 """Utility functions"""
 
@@ -19,15 +23,34 @@ def _jump_list(target: Union[dict, list], key: str) -> list:
     list
         The list of values
     """
-    if isinstance(target, dict):
-        value = target.get(key, None)
-        return [value] if value else []
-    if isinstance(target, list):
-        values = []
-        for item in target:
-            value = _jump_list(item, key)
-            values.extend(value)
-        return values
+    values = []
+    # Walk nested lists with an explicit stack instead of recursion,
+    # pushing items in reverse to keep them in document order
+    stack = [target]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            value = item.get(key, None)
+            if value: values.append(value)
+        elif isinstance(item, list):
+            stack.extend(reversed(item))
+    return values
+
+@lru_cache(maxsize=256)
+def _compile_path(path: str) -> Tuple[str, ...]:
+    """Splits a path in dot notation into its steps, caching the result
+
+    Arguments
+    ---------
+    path : str
+        A path of keys in dot notation
+
+    Returns
+    -------
+    tuple[str, ...]
+        The keys of the path
+    """
+    return tuple(path.split('.'))
 
 def by_dot(record: dict, path: str) -> list:
     """Allows access to a dictionary by dot notation and returns a list of values
@@ -52,12 +75,9 @@ def by_dot(record: dict, path: str) -> list:
     the : Simplify list with only a single element
     """
     current = [record]
-    for step in path.split('.'):
-        branches = []
-        for branch in current:
-            value = _jump_list(branch, step)
-            if value: branches.extend(value)
-        current = branches 
+    for step in _compile_path(path):
+        # The current branches form a list themselves, so they can be resolved in one go
+        current = _jump_list(current, step)
     return current
 
 def the(l: list) -> Any:
@@ -84,3 +104,62 @@ def the(l: list) -> Any:
         raise ValueError(f"{l} contains more than one element")
     else:
         return l[0]
+
+# === Caching ===
+
+_KWD_MARK = object()
+
+def ttl_cache(maxsize: int = 1024, ttl: float = 300) -> Callable:
+    """Decorator that caches the results of a function for a limited time
+
+    Results are keyed by the arguments of the call, so these must be hashable.
+    When more than `maxsize` results are cached, the least recently used one
+    is evicted. The cache can be emptied by calling `cache_clear()` on the
+    decorated function.
+
+    Arguments
+    ---------
+    maxsize : int
+        Maximum number of results to be cached (0 disables caching)
+    ttl : float
+        Number of seconds a result is kept (0 disables caching)
+
+    Returns
+    -------
+    Callable
+        The decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        cache = OrderedDict()
+        lock = Lock()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if maxsize <= 0 or ttl <= 0:
+                return func(*args, **kwargs)
+            key = args
+            if kwargs:
+                # Separate keyword arguments so that f(1, ('a', 2)) and f(1, a=2) differ
+                key += (_KWD_MARK,) + tuple(sorted(kwargs.items()))
+            with lock:
+                if key in cache:
+                    value, expires_at = cache[key]
+                    if expires_at > monotonic():
+                        cache.move_to_end(key)
+                        return value
+                    del cache[key]
+            value = func(*args, **kwargs)
+            with lock:
+                cache[key] = (value, monotonic() + ttl)
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return value
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
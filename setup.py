@@ -20,5 +20,9 @@ setuptools.setup(
     install_requires=[
         "requests",
     ],
+    extras_require={
+        "fast": ["orjson"],
+        "async": ["aiohttp"],
+    },
     python_requires=    '>=3.8.5'
 )
\ No newline at end of file
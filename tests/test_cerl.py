@@ -0,0 +1,287 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import cerl.cerl as cerl
+
+
+def test_setting_falls_back_on_invalid_value(monkeypatch):
+    monkeypatch.setenv('CERL_TEST_SETTING', 'abc')
+    with pytest.warns(UserWarning, match='CERL_TEST_SETTING'):
+        assert cerl._setting('CERL_TEST_SETTING', 5, int) == 5
+
+
+@pytest.mark.parametrize('value', ['0', '-1'])
+def test_setting_falls_back_below_minimum(monkeypatch, value):
+    monkeypatch.setenv('CERL_TEST_SETTING', value)
+    with pytest.warns(UserWarning, match='CERL_TEST_SETTING'):
+        assert cerl._setting('CERL_TEST_SETTING', 5, int, minimum=1) == 5
+
+
+def test_setting_accepts_minimum(monkeypatch):
+    monkeypatch.setenv('CERL_TEST_SETTING', '0')
+    assert cerl._setting('CERL_TEST_SETTING', 5, int, minimum=0) == 0
+
+
+def test_setting_reads_environment(monkeypatch):
+    monkeypatch.setenv('CERL_TEST_SETTING', '2.5')
+    assert cerl._setting('CERL_TEST_SETTING', 5, float) == 2.5
+    monkeypatch.delenv('CERL_TEST_SETTING')
+    assert cerl._setting('CERL_TEST_SETTING', 5, float) == 5
+
+
+def test_ample_query_generator_warns_on_call():
+    with pytest.warns(DeprecationWarning) as record:
+        cerl.ample_query_generator('example.org/db', 'query')
+    assert record[0].filename == __file__
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = json.dumps(body, ensure_ascii=False).encode()
+        self.raw = io.BytesIO(self.content)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeHttp:
+    """Answers search requests for a query with `hits` hits, delaying early pages"""
+
+    def __init__(self, hits):
+        self.hits = hits
+        self.requested = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get(self, url, stream=False):
+        params = parse_qs(urlparse(url).query)
+        size = int(params['size'][0])
+        if size == 1:
+            return FakeResponse({'hits': {'value': self.hits}})
+        offset = int(params['from'][0])
+        with self.lock:
+            self.requested.append(offset)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Make earlier pages finish last to check that the order is kept
+        time.sleep(0.001 * (10 - offset // 100 % 10))
+        with self.lock:
+            self.in_flight -= 1
+        rows = [{'id': str(i)} for i in range(offset, min(offset + size, self.hits))]
+        return FakeResponse({'rows': rows})
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    def install(hits):
+        fake = FakeHttp(hits)
+        monkeypatch.setattr(cerl, 'http', fake)
+        return fake
+    return install
+
+
+@pytest.mark.parametrize('hits, expected', [(0, 0), (50, 50), (950, 950), (25000, 10000)])
+def test_ample_query_keeps_order(fake_http, hits, expected):
+    fake_http(hits)
+    result = cerl.ample_query('example.org/db', 'query')
+    assert result.hits == hits
+    assert cerl.ids_from_result(result) == [str(i) for i in range(expected)]
+
+
+def test_ample_query_iter_requests_pages_lazily(fake_http, monkeypatch):
+    monkeypatch.setattr(cerl, 'MAX_WORKERS', 4)
+    fake = fake_http(5000)
+    hits, rows = cerl.ample_query_iter('example.org/db', 'query')
+    assert hits == 5000
+    assert fake.requested == []
+    assert [next(rows)['id'] for _ in range(150)] == [str(i) for i in range(150)]
+    # Two pages consumed, so at most four more may have been requested
+    assert {0, 100} <= set(fake.requested)
+    assert max(fake.requested) <= 500
+    assert len(list(rows)) == 5000 - 150
+    assert fake.max_in_flight <= 4
+
+
+@pytest.mark.parametrize('record, expected', [
+    ({'_id': 'cnp00000001'}, 'cnp00000001'),
+    ({'_id': ['cnp00000001']}, 'cnp00000001'),
+])
+def test_cid(record, expected):
+    assert cerl.cid(record) == expected
+
+
+@pytest.mark.parametrize('record', [{}, {'_id': ''}, {'_id': ['']}, {'_id': ['a', 'b']}, {'_id': 1}])
+def test_cid_raises_without_identifier(record):
+    with pytest.raises(ValueError):
+        cerl.cid(record)
+
+
+class FakeRecordHttp:
+    def __init__(self):
+        self.requested = []
+
+    def get(self, url):
+        self.requested.append(url)
+        response = FakeResponse({'_id': 'cnp00000001', 'name': 'Müller'})
+        response.encoding = 'utf-8'
+        return response
+
+
+def test_records_are_cached(monkeypatch):
+    fake = FakeRecordHttp()
+    monkeypatch.setattr(cerl, 'http', fake)
+    cerl.clear_cache()
+    record = cerl.ample_record('example.org/db', 'cnp00000001')
+    record['name'] = 'changed'
+    assert cerl.ample_record('example.org/db', 'cnp00000001')['name'] == 'Müller'
+    assert 'Müller' in cerl.ample_record_export('example.org/db', 'cnp00000001', 'json')
+    assert len(fake.requested) == 1
+    cerl.clear_cache()
+    cerl.ample_record('example.org/db', 'cnp00000001')
+    assert len(fake.requested) == 2
+
+
+requires_aiohttp = pytest.mark.skipif(cerl.aiohttp is None, reason="aiohttp is not installed")
+
+_sleep = asyncio.sleep
+
+
+class FakeResponseError(Exception):
+    pass
+
+
+class FakeAsyncResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise FakeResponseError(self.status)
+
+    async def read(self):
+        return self.body
+
+
+class FakeAsyncRequest:
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+
+    async def __aenter__(self):
+        session = self.session
+        session.requested.append(self.url)
+        session.in_flight += 1
+        session.max_in_flight = max(session.max_in_flight, session.in_flight)
+        await _sleep(0.001)
+        return FakeAsyncResponse(*session.respond(self.url))
+
+    async def __aexit__(self, *args):
+        self.session.in_flight -= 1
+
+
+class FakeAsyncSession:
+    """Answers requests with the (status, body) returned by `respond(url)`"""
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def get(self, url):
+        return FakeAsyncRequest(self, url)
+
+
+@pytest.fixture
+def fake_session(monkeypatch):
+    def install(respond):
+        session = FakeAsyncSession(respond)
+        monkeypatch.setattr(cerl, '_async_session', lambda: session)
+        return session
+    return install
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+        await _sleep(0)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    return delays
+
+
+def search_body(hits, url):
+    params = parse_qs(urlparse(url).query)
+    size = int(params['size'][0])
+    if size == 1:
+        return json.dumps({'hits': {'value': hits}}).encode()
+    offset = int(params['from'][0])
+    rows = [{'id': str(i)} for i in range(offset, min(offset + size, hits))]
+    return json.dumps({'rows': rows}).encode()
+
+
+@requires_aiohttp
+def test_get_async_retries_with_backoff(fake_session, sleeps):
+    statuses = iter([503, 500, 200])
+    session = fake_session(lambda url: (next(statuses), b'body'))
+    body = asyncio.run(cerl._get_async(session, asyncio.Semaphore(1), 'https://example.org'))
+    assert body == b'body'
+    assert len(session.requested) == 3
+    assert sleeps == [cerl.BACKOFF_FACTOR, cerl.BACKOFF_FACTOR * 2]
+
+
+@requires_aiohttp
+def test_get_async_raises_after_last_attempt(fake_session, sleeps):
+    session = fake_session(lambda url: (503, b''))
+    with pytest.raises(FakeResponseError):
+        asyncio.run(cerl._get_async(session, asyncio.Semaphore(1), 'https://example.org'))
+    assert len(session.requested) == cerl.RETRIES + 1
+
+
+@requires_aiohttp
+def test_get_async_does_not_retry_client_errors(fake_session, sleeps):
+    session = fake_session(lambda url: (404, b''))
+    with pytest.raises(FakeResponseError):
+        asyncio.run(cerl._get_async(session, asyncio.Semaphore(1), 'https://example.org'))
+    assert len(session.requested) == 1
+
+
+@requires_aiohttp
+@pytest.mark.parametrize('hits, expected', [(0, 0), (950, 950), (25000, 10000)])
+def test_ample_query_async_keeps_order(fake_session, monkeypatch, hits, expected):
+    monkeypatch.setattr(cerl, 'CONNECTION_POOL_SIZE', 4)
+    session = fake_session(lambda url: (200, search_body(hits, url)))
+    result = asyncio.run(cerl.ample_query_async('example.org/db', 'query'))
+    assert result.hits == hits
+    assert cerl.ids_from_result(result) == [str(i) for i in range(expected)]
+    assert session.max_in_flight <= 4
+
+
+@requires_aiohttp
+def test_ample_records_async_limits_concurrency(fake_session, monkeypatch):
+    monkeypatch.setattr(cerl, 'CONNECTION_POOL_SIZE', 2)
+    ids = [f'cnp{i:08}' for i in range(10)]
+    session = fake_session(lambda url: (200, json.dumps({'_id': urlparse(url).path.split('/')[-1]}).encode()))
+    records = asyncio.run(cerl.ample_records_async('example.org/db', ids))
+    assert [record['_id'] for record in records] == ids
+    assert session.max_in_flight == 2
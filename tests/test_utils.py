@@ -0,0 +1,114 @@
+import pytest
+
+import cerl.utils as utils
+from cerl.utils import by_dot, ttl_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(utils, 'monotonic', lambda: now[0])
+    return now
+
+
+def counting(maxsize=2, ttl=10):
+    calls = []
+
+    @ttl_cache(maxsize=maxsize, ttl=ttl)
+    def f(x):
+        calls.append(x)
+        return x * 2
+
+    return f, calls
+
+
+def test_ttl_cache_returns_cached_value(clock):
+    f, calls = counting()
+    assert f(1) == 2
+    assert f(1) == 2
+    assert calls == [1]
+
+
+def test_ttl_cache_expires_entries(clock):
+    f, calls = counting(ttl=10)
+    f(1)
+    clock[0] = 9.9
+    f(1)
+    clock[0] = 10.0
+    f(1)
+    assert calls == [1, 1]
+
+
+def test_ttl_cache_evicts_least_recently_used(clock):
+    f, calls = counting(maxsize=2)
+    f(1)
+    f(2)
+    f(1)  # 1 is now more recently used than 2
+    f(3)  # evicts 2
+    f(1)
+    f(2)
+    assert calls == [1, 2, 3, 2]
+
+
+def test_ttl_cache_clear(clock):
+    f, calls = counting()
+    f(1)
+    f.cache_clear()
+    f(1)
+    assert calls == [1, 1]
+
+
+def test_ttl_cache_disabled(clock):
+    f, calls = counting(maxsize=0)
+    f(1)
+    f(1)
+    assert calls == [1, 1]
+
+
+RECORD = {
+    '_id': 'cnp00000001',
+    'name': [
+        {'forms': [{'value': 'a'}, [{'value': 'b'}, {'value': 'c'}]]},
+        {'forms': {'value': 'd'}},
+        [{'forms': [[{'value': 'e'}]]}],
+    ],
+}
+
+
+def test_by_dot_single_value():
+    assert by_dot(RECORD, '_id') == ['cnp00000001']
+
+
+def test_by_dot_jumps_nested_lists_in_document_order():
+    assert by_dot(RECORD, 'name.forms.value') == ['a', 'b', 'c', 'd', 'e']
+
+
+def test_by_dot_returns_lists_as_values():
+    assert by_dot({'a': [1, 2]}, 'a') == [[1, 2]]
+
+
+def test_by_dot_drops_missing_and_falsy_values():
+    record = {'a': [{'b': 0}, {'b': ''}, {'b': None}, {'b': []}, {}, {'b': 'x'}]}
+    assert by_dot(record, 'a.b') == ['x']
+    assert by_dot(record, 'missing.b') == []
+
+
+def test_by_dot_skips_scalars_inside_lists():
+    assert by_dot({'a': [1, 'text', {'b': 'x'}]}, 'a.b') == ['x']
+
+
+def test_compile_path_is_cached():
+    utils._compile_path.cache_clear()
+    assert utils._compile_path('name.forms.value') == ('name', 'forms', 'value')
+    assert utils._compile_path('name.forms.value') is utils._compile_path('name.forms.value')
+    info = utils._compile_path.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_ttl_cache_separates_positional_and_keyword_arguments(clock):
+    @ttl_cache()
+    def f(*args, **kwargs):
+        return args, kwargs
+
+    assert f(1, ('a', 2)) == ((1, ('a', 2)), {})
+    assert f(1, a=2) == ((1,), {'a': 2})